@@ -1,9 +1,12 @@
+import io
 import streamlit as st
 import numpy as np
 import pandas as pd
+import altair as alt
+import matplotlib
+matplotlib.use("Agg")  # rendu hors écran uniquement (pas de backend GUI à initialiser)
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
-from datetime import date
 
 # =========================
 # Constants
@@ -40,6 +43,7 @@ def adherence_level(deficit_kcal_per_day, weeks):
     else:
         return "Challenging 🔴", "Ambitieux — réduis le déficit ou allonge la durée."
 
+@st.cache_data(show_spinner=False, max_entries=32)
 def plan_physio(sex, age, height_cm, weight_start, weight_goal, weeks, activity_level,
                 min_deficit=300, max_deficit=900):
     """Retourne BMR/TDEE, déficit requis & effectif (plancher), projections, etc."""
@@ -84,17 +88,81 @@ def plan_physio(sex, age, height_cm, weight_start, weight_goal, weeks, activity_
         level=level, comment=msg
     )
 
+@st.cache_data(show_spinner=False, max_entries=32)
 def projection_effective(weight_start, target_loss_kg, physio_total_kg, weeks):
     """Projection vers le poids réellement atteignable au bout de N semaines."""
     achievable_loss = min(target_loss_kg, physio_total_kg)
     end_weight = weight_start - achievable_loss
     t = np.arange(0, int(np.ceil(weeks)) + 1)
     w = weight_start + (end_weight - weight_start) * (t / max(1, weeks))
-    return pd.DataFrame({"Week": t, "Weight (kg)": w})
+    return {"Week": t, "Weight (kg)": w}
+
+# =========================
+# Helpers (theme & charts)
+# =========================
+@st.cache_resource
+def app_css():
+    """CSS du thème (statique) — construit une fois par process."""
+    return f"""
+<style>
+  .stApp {{ background: {PALETTE['panel']}; }}
+  h1, h2, h3 {{ color: {PALETTE['deep']} !important; }}
+  .metric-value, .metric-label {{ color: {PALETTE['ink']} !important; }}
+  .st-emotion-cache-ue6h4q {{ color: {PALETTE['muted']} !important; }}
+</style>
+"""
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def projection_png(weight_start, target_loss_kg, physio_total_kg, weeks, weeks_needed_safe):
+    """Graphe de projection (Tab 1) rendu en PNG, mis en cache sur les scalaires qui le définissent."""
+    dfp = projection_effective(weight_start, target_loss_kg, physio_total_kg, weeks)
+    y = dfp["Weight (kg)"]
+    y_min, y_max = float(y.min()), float(y.max())
+    pad = max(0.5, (y_max - y_min) * 0.15)
+
+    fig, ax = plt.subplots(figsize=(8, 4))
+    ax.plot(
+        dfp["Week"], dfp["Weight (kg)"],
+        color=PALETTE["accent"], linewidth=3, marker="o",
+        markersize=6, markerfacecolor=PALETTE["sun"],
+        markeredgecolor="white", alpha=0.95, label="Projection (achievable)"
+    )
+    ax.fill_between(dfp["Week"], dfp["Weight (kg)"], color=PALETTE["mid"], alpha=0.15)
+
+    ax.set_facecolor(PALETTE["panel"])
+    fig.patch.set_facecolor(PALETTE["panel"])
+    for sside in ("top", "right"):
+        ax.spines[sside].set_visible(False)
+    ax.spines["left"].set_color(PALETTE["grid"])
+    ax.spines["bottom"].set_color(PALETTE["grid"])
+    ax.grid(alpha=0.18, color=PALETTE["grid"], linewidth=0.8)
+    ax.set_ylim(y_min - pad, y_max + pad)
+    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+    ax.set_title("🏋️ Weight Projection", fontsize=14, fontweight="bold", color=PALETTE["deep"], pad=12)
+    ax.set_xlabel("Weeks", fontsize=11, color=PALETTE["muted"])
+    ax.set_ylabel("Weight (kg)", fontsize=11, color=PALETTE["muted"])
+    ax.legend(frameon=False)
+
+    # ✅ condition correcte (corrige l'erreur de frappe précédente)
+    goal_reached = physio_total_kg + 1e-6 >= target_loss_kg
+    if not goal_reached:
+        msg = (f"Goal not reachable in {weeks} weeks at safe intake.\n~{weeks_needed_safe:.1f} weeks needed."
+               if np.isfinite(weeks_needed_safe) else
+               "Goal not reachable at current safe intake.")
+        ax.text(0.02, 0.02, msg, transform=ax.transAxes, fontsize=10, color=PALETTE["mid"])
+
+    buf = io.BytesIO()
+    try:
+        fig.savefig(buf, format="png", dpi=150, bbox_inches="tight")
+    finally:
+        plt.close(fig)  # jamais de Figure vivante en cache ni dans le registre pyplot
+    return buf.getvalue()
 
 # =========================
 # Helpers (tracking & nutrition)
 # =========================
+TRACKING_COLUMNS = ("Date", "Weight (kg)", "Calories")
+
 def ensure_tracking_schema(df: pd.DataFrame) -> pd.DataFrame:
     """Normalise le schéma: Date (datetime64[ns]), Weight (float), Calories (float)."""
     if df is None:
@@ -103,7 +171,11 @@ def ensure_tracking_schema(df: pd.DataFrame) -> pd.DataFrame:
     out["Date"] = pd.to_datetime(df.get("Date", pd.Series([], dtype="datetime64[ns]")), errors="coerce")
     out["Weight (kg)"] = pd.to_numeric(df.get("Weight (kg)", pd.Series([], dtype="float")), errors="coerce")
     out["Calories"] = pd.to_numeric(df.get("Calories", pd.Series([], dtype="float")), errors="coerce")
-    return out[["Date", "Weight (kg)", "Calories"]]
+    return out[list(TRACKING_COLUMNS)]
+
+def read_tracking_csv(f) -> pd.DataFrame:
+    """Lit un CSV de suivi; ne parse que les colonnes utiles (les colonnes en trop ne sont jamais allouées)."""
+    return pd.read_csv(f, usecols=lambda c: c in TRACKING_COLUMNS)
 
 def macro_split(calories, p_ratio=0.30, c_ratio=0.40, f_ratio=0.30):
     p_cal, c_cal, f_cal = calories * p_ratio, calories * c_ratio, calories * f_ratio
@@ -113,79 +185,147 @@ def scaled_grams(target_cals, base_cals, grams):
     factor = target_cals / base_cals
     return {k: round(v * factor) for k, v in grams.items()}
 
-TEMPLATES = [
+TEMPLATES = (
     dict(
         name="Lean & Simple", base_cals=1600,
-        meals=[
+        meals=(
             ("Breakfast", "Skyr 0% 200g + oats 50g + banana 1", {"skyr_g":200,"oats_g":50,"banana":1}),
             ("Lunch", "Chicken 150g + quinoa 70g (dry) + veg", {"chicken_g":150,"quinoa_dry_g":70,"veg_serv":2}),
             ("Snack", "Cottage cheese 200g + berries 100g", {"cottage_g":200,"berries_g":100}),
             ("Dinner","Salmon 140g + rice 75g (dry) + salad + olive oil",
              {"salmon_g":140,"rice_dry_g":75,"olive_oil_tbsp":1,"salad_serv":2}),
-        ],
-        swaps=["Swap salmon ↔️ tofu 200g","Swap quinoa ↔️ whole-wheat pasta","Add 1 tbsp peanut butter if hunger"]
+        ),
+        swaps=("Swap salmon ↔️ tofu 200g","Swap quinoa ↔️ whole-wheat pasta","Add 1 tbsp peanut butter if hunger")
     ),
     dict(
         name="Balanced Med", base_cals=2000,
-        meals=[
+        meals=(
             ("Breakfast","Eggs 3 + whole bread 2 slices + fruit",{"eggs":3,"bread_slices":2,"fruit":1}),
             ("Lunch","Turkey 160g + couscous 90g (dry) + veg",{"turkey_g":160,"couscous_dry_g":90,"veg_serv":2}),
             ("Snack","Greek yogurt 250g + honey 10g + nuts 20g",{"yogurt_g":250,"honey_g":10,"nuts_g":20}),
             ("Dinner","Beef 150g + potatoes 300g + green beans",{"beef_g":150,"potatoes_g":300,"beans_serv":2}),
-        ],
-        swaps=["Honey ↔️ jam","Beef ↔️ chicken 170g","Add olive oil 1 tbsp if low on calories"]
+        ),
+        swaps=("Honey ↔️ jam","Beef ↔️ chicken 170g","Add olive oil 1 tbsp if low on calories")
     ),
     dict(
         name="High-Energy", base_cals=2400,
-        meals=[
+        meals=(
             ("Breakfast","Oats 80g + whey 30g + milk 300ml + berries",{"oats_g":80,"whey_g":30,"milk_ml":300,"berries_g":100}),
             ("Lunch","Pasta 110g (dry) + tuna 1 can + tomato sauce",{"pasta_dry_g":110,"tuna_can":1,"sauce_serv":1}),
             ("Snack","Protein bar + banana + almonds 25g",{"bar":1,"banana":1,"almonds_g":25}),
             ("Dinner","Chicken 200g + rice 100g (dry) + olive oil 1tbsp",{"chicken_g":200,"rice_dry_g":100,"olive_oil_tbsp":1,"veg_serv":2}),
-        ],
-        swaps=["Tuna ↔️ lentils 200g (cooked)","Almonds ↔️ cashews","Add parmesan 15g if needed"]
+        ),
+        swaps=("Tuna ↔️ lentils 200g (cooked)","Almonds ↔️ cashews","Add parmesan 15g if needed")
     ),
-]
+)
 
 def pick_template(cal_target):
     idx = np.argmin([abs(cal_target - t["base_cals"]) for t in TEMPLATES])
     return TEMPLATES[idx]
 
-def render_meal_plan(cal_target):
-    macros = macro_split(cal_target)
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_meal_plan(cal_target):
+    """Template le plus proche + grammages scalés + macros pour une cible calorique."""
     tpl = pick_template(cal_target)
+    meals = [(title, desc, scaled_grams(cal_target, tpl["base_cals"], grams))
+             for title, desc, grams in tpl["meals"]]
+    # Markdown pré-rendu ici (mis en cache) → un seul st.markdown par bloc au rendu
+    blocks = []
+    for title, desc, scaled in meals:
+        lines = "\n".join(f"- {k}: {v}" for k, v in scaled.items())
+        blocks.append(f"**{title}** — {desc}\n\n```python\n{lines}\n```")  # = défaut de st.code
+    tips = [f"• {sw}" for sw in tpl["swaps"]]
+    tips.append("• Protéines ≈ 1.6–2.2 g/kg de poids de corps. Ajuste si training ↑.")
+    return dict(name=tpl["name"], base_cals=tpl["base_cals"], macros=macro_split(cal_target),
+                meals_md="\n\n".join(blocks), swaps_md="  \n".join(tips))
+
+def render_meal_plan(cal_target):
+    plan = build_meal_plan(cal_target)
+    macros = plan["macros"]
     st.subheader(f"🍽️ Plan auto pour ~{int(cal_target)} kcal/j")
-    st.caption(f"Template: **{tpl['name']}** (scalé depuis {tpl['base_cals']} kcal) • "
+    st.caption(f"Template: **{plan['name']}** (scalé depuis {plan['base_cals']} kcal) • "
                f"≈ {macros['protein_g']}g P / {macros['carbs_g']}g C / {macros['fat_g']}g F")
 
-    for title, desc, grams in tpl["meals"]:
-        scaled = scaled_grams(cal_target, tpl["base_cals"], grams)
-        st.markdown(f"**{title}** — {desc}")
-        st.code("\n".join([f"- {k}: {v}" for k, v in scaled.items()]))
+    st.markdown(plan["meals_md"])
 
     with st.expander("Swaps & tips"):
-        for s in tpl["swaps"]:
-            st.write(f"• {s}")
-        st.write("• Protéines ≈ 1.6–2.2 g/kg de poids de corps. Ajuste si training ↑.")
+        st.markdown(plan["swaps_md"])
+
+@st.fragment
+def render_tracking(dfp, kcal_target):
+    """Onglet Suivi; en fragment pour que les éditions du tableau ne relancent que cet onglet."""
+    st.subheader("📈 Suivi & comparaison")
+    st.caption("Entre tes mesures (poids, calories…) et compare à la projection.")
+
+    if "tracking_df" not in st.session_state:
+        st.session_state.tracking_df = ensure_tracking_schema(pd.DataFrame())
+
+    with st.expander("Importer un CSV (colonnes: Date, Weight (kg), Calories)"):
+        up = st.file_uploader("Upload CSV", type=["csv"])
+        if up is not None:
+            try:
+                st.session_state.tracking_df = ensure_tracking_schema(read_tracking_csv(up))
+                st.success("Import ok.")
+            except Exception as e:
+                st.error(f"CSV illisible: {e}")
+
+    st.write("Ajoute/modifie tes lignes ci-dessous :")
+    edited = st.data_editor(
+        st.session_state.tracking_df,
+        num_rows="dynamic",
+        use_container_width=True,
+        column_config={
+            "Date": st.column_config.DatetimeColumn(format="YYYY-MM-DD", step=86400),
+            "Weight (kg)": st.column_config.NumberColumn(step=0.1, format="%.1f"),
+            "Calories": st.column_config.NumberColumn(step=10, format="%.0f"),
+        },
+        key="editor"
+    )
+    st.session_state.tracking_df = ensure_tracking_schema(edited)
+
+    # Courbes : réel vs projection
+    df_plot = st.session_state.tracking_df.dropna(subset=["Date", "Weight (kg)"]).copy()
+    if not df_plot.empty:
+        df_plot["Date"] = pd.to_datetime(df_plot["Date"])
+        df_plot["Day"] = (df_plot["Date"] - df_plot["Date"].min()).dt.days
+        df_plot["Week"] = df_plot["Day"] / 7.0
+
+        # Rendu Vega côté navigateur (pas de Figure matplotlib) : projection en ligne, mesures en points
+        proj = pd.DataFrame({"Week": dfp["Week"], "Weight (kg)": dfp["Weight (kg)"],
+                             "Series": "Projection (achievable)"})
+        actual = df_plot[["Week", "Weight (kg)"]].assign(Series="Actual")
+        x = alt.X("Week:Q", title="Weeks")
+        y = alt.Y("Weight (kg):Q", scale=alt.Scale(zero=False))  # Y non ancré à 0, comme l'onglet Plan
+        color = alt.Color("Series:N", title=None,
+                          scale=alt.Scale(domain=["Projection (achievable)", "Actual"],
+                                          range=[PALETTE["accent"], PALETTE["mid"]]))
+        chart = alt.layer(
+            alt.Chart(proj).mark_line(strokeWidth=3).encode(x=x, y=y, color=color),
+            alt.Chart(actual).mark_circle(size=60, opacity=1).encode(
+                x=x, y=y, color=color, tooltip=["Week:Q", "Weight (kg):Q"]),
+        ).properties(title="Weight: Actual vs Projection")
+        st.altair_chart(chart)
+
+    # Récap calories vs cible
+    if not st.session_state.tracking_df.empty and "Calories" in st.session_state.tracking_df:
+        avg_cal = st.session_state.tracking_df["Calories"].dropna().mean()
+        if np.isfinite(avg_cal):
+            delta = avg_cal - kcal_target
+            signe = "au-dessus" if delta > 0 else "en dessous"
+            st.info(f"Apport moyen: **{avg_cal:.0f} kcal/j** "
+                    f"({abs(delta):.0f} kcal {signe} de la cible **{kcal_target:.0f}**).")
 
 # =========================
 # App (3 onglets)
 # =========================
 st.set_page_config(page_title="FitPath — Physiological MVP", page_icon="🏋️", layout="centered")
-st.markdown(f"""
-<style>
-  .stApp {{ background: {PALETTE['panel']}; }}
-  h1, h2, h3 {{ color: {PALETTE['deep']} !important; }}
-  .metric-value, .metric-label {{ color: {PALETTE['ink']} !important; }}
-  .st-emotion-cache-ue6h4q {{ color: {PALETTE['muted']} !important; }}
-</style>
-""", unsafe_allow_html=True)
+st.markdown(app_css(), unsafe_allow_html=True)
 
 st.title("🏋️ FitPath — Physiological MVP")
 st.caption("BMR → TDEE → Deficit → Calories → Projection • Fake-AI meal plans • Progress tracking")
 
-# Sidebar (global inputs)
-with st.sidebar:
+# Sidebar (global inputs) — en formulaire : un seul rerun à la validation, pas un par champ
+with st.sidebar, st.form("user_settings"):
     st.header("User Settings")
     sex = st.selectbox("Gender", ["Male", "Female"])
     age = st.number_input("Age", 18, 80, 26)
@@ -195,6 +335,7 @@ with st.sidebar:
     weeks = st.number_input("Duration (weeks)", 1, 52, 8)
     activity_level = st.selectbox("Activity level",
                                   ["Sedentary","Lightly Active","Moderately Active","Very Active","Extra Active"])
+    st.form_submit_button("Update plan", width="stretch")
 
 # Calculs + projection pour les onglets
 out = plan_physio(sex, age, height_cm, weight_start, weight_goal, weeks, activity_level)
@@ -229,42 +370,8 @@ with tab1:
     st.info(f"**Feasibility:** {out['level']} — {out['comment']}")
 
     # ----- Chart (projection atteignable, Y non ancré à 0) -----
-    y = dfp["Weight (kg)"].values
-    y_min, y_max = float(y.min()), float(y.max())
-    pad = max(0.5, (y_max - y_min) * 0.15)
-
-    fig, ax = plt.subplots(figsize=(8, 4))
-    ax.plot(
-        dfp["Week"], dfp["Weight (kg)"],
-        color=PALETTE["accent"], linewidth=3, marker="o",
-        markersize=6, markerfacecolor=PALETTE["sun"],
-        markeredgecolor="white", alpha=0.95, label="Projection (achievable)"
-    )
-    ax.fill_between(dfp["Week"], dfp["Weight (kg)"], color=PALETTE["mid"], alpha=0.15)
-
-    ax.set_facecolor(PALETTE["panel"])
-    fig.patch.set_facecolor(PALETTE["panel"])
-    for sside in ("top", "right"):
-        ax.spines[sside].set_visible(False)
-    ax.spines["left"].set_color(PALETTE["grid"])
-    ax.spines["bottom"].set_color(PALETTE["grid"])
-    ax.grid(alpha=0.18, color=PALETTE["grid"], linewidth=0.8)
-    ax.set_ylim(y_min - pad, y_max + pad)
-    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-    ax.set_title("🏋️ Weight Projection", fontsize=14, fontweight="bold", color=PALETTE["deep"], pad=12)
-    ax.set_xlabel("Weeks", fontsize=11, color=PALETTE["muted"])
-    ax.set_ylabel("Weight (kg)", fontsize=11, color=PALETTE["muted"])
-    ax.legend(frameon=False)
-
-    # ✅ condition correcte (corrige l'erreur de frappe précédente)
-    goal_reached = out["physio_total_kg"] + 1e-6 >= out["target_loss_kg"]
-    if not goal_reached:
-        msg = (f"Goal not reachable in {weeks} weeks at safe intake.\n~{out['weeks_needed_safe']:.1f} weeks needed."
-               if np.isfinite(out["weeks_needed_safe"]) else
-               "Goal not reachable at current safe intake.")
-        ax.text(0.02, 0.02, msg, transform=ax.transAxes, fontsize=10, color=PALETTE["mid"])
-
-    st.pyplot(fig)
+    st.image(projection_png(weight_start, out["target_loss_kg"], out["physio_total_kg"],
+                            weeks, out["weeks_needed_safe"]))
 
     with st.expander("🧠 How it’s calculated"):
         st.markdown(
@@ -290,63 +397,4 @@ with tab2:
 
 # ---------- Tab 3: Suivi ----------
 with tab3:
-    st.subheader("📈 Suivi & comparaison")
-    st.caption("Entre tes mesures (poids, calories…) et compare à la projection.")
-
-    if "tracking_df" not in st.session_state:
-        st.session_state.tracking_df = ensure_tracking_schema(pd.DataFrame())
-
-    with st.expander("Importer un CSV (colonnes: Date, Weight (kg), Calories)"):
-        up = st.file_uploader("Upload CSV", type=["csv"])
-        if up is not None:
-            try:
-                dfu = pd.read_csv(up)
-                st.session_state.tracking_df = ensure_tracking_schema(dfu)
-                st.success("Import ok.")
-            except Exception as e:
-                st.error(f"CSV illisible: {e}")
-
-    st.write("Ajoute/modifie tes lignes ci-dessous :")
-    edited = st.data_editor(
-        st.session_state.tracking_df,
-        num_rows="dynamic",
-        use_container_width=True,
-        column_config={
-            "Date": st.column_config.DatetimeColumn(format="YYYY-MM-DD", step=86400),
-            "Weight (kg)": st.column_config.NumberColumn(step=0.1, format="%.1f"),
-            "Calories": st.column_config.NumberColumn(step=10, format="%.0f"),
-        },
-        key="editor"
-    )
-    st.session_state.tracking_df = ensure_tracking_schema(edited)
-
-    # Courbes : réel vs projection
-    df_plot = st.session_state.tracking_df.dropna(subset=["Date", "Weight (kg)"]).copy()
-    if not df_plot.empty:
-        df_plot["Date"] = pd.to_datetime(df_plot["Date"])
-        df_plot["Day"] = (df_plot["Date"] - df_plot["Date"].min()).dt.days
-        df_plot["Week"] = df_plot["Day"] / 7.0
-
-        fig2, ax2 = plt.subplots(figsize=(8, 4))
-        ax2.plot(dfp["Week"], dfp["Weight (kg)"], linewidth=3, label="Projection (achievable)")
-        ax2.scatter(df_plot["Week"], df_plot["Weight (kg)"], s=35, label="Actual", zorder=3)
-
-        ax2.set_facecolor(PALETTE["panel"]); fig2.patch.set_facecolor(PALETTE["panel"])
-        for sside in ("top","right"): ax2.spines[sside].set_visible(False)
-        ax2.spines["left"].set_color(PALETTE["grid"]); ax2.spines["bottom"].set_color(PALETTE["grid"])
-        ax2.grid(alpha=0.18, color=PALETTE["grid"], linewidth=0.8)
-        ax2.set_title("Weight: Actual vs Projection", fontsize=14, fontweight="bold", color=PALETTE["deep"], pad=12)
-        ax2.set_xlabel("Weeks", fontsize=11, color=PALETTE["muted"])
-        ax2.set_ylabel("Weight (kg)", fontsize=11, color=PALETTE["muted"])
-        ax2.legend(frameon=False)
-        st.pyplot(fig2)
-
-    # Récap calories vs cible
-    if not st.session_state.tracking_df.empty and "Calories" in st.session_state.tracking_df:
-        avg_cal = st.session_state.tracking_df["Calories"].dropna().mean()
-        if np.isfinite(avg_cal):
-            delta = avg_cal - out["kcal"]
-            signe = "au-dessus" if delta > 0 else "en dessous"
-            st.info(f"Apport moyen: **{avg_cal:.0f} kcal/j** "
-                    f"({abs(delta):.0f} kcal {signe} de la cible **{out['kcal']:.0f}**).")
-
+    render_tracking(dfp, out["kcal"])